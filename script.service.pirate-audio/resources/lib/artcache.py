@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+# Copyright (c) 2020 Jiri Benc <jbenc@upir.cz>
+
+import xbmc
+import collections
+import os
+import threading
+import time
+from urllib.parse import unquote
+
+
+def unwrap_image_url(url):
+    """JSON-RPC returns art URLs wrapped in image://<url-encoded>/ while the
+    texture database and info labels use the bare URL."""
+    if url.startswith('image://') and url.endswith('/'):
+        return unquote(url[8:-1])
+    return url
+
+
+class ArtCache:
+    """Bounded cache of art URL -> local file resolutions. Looking up a URL
+    in the Kodi texture database is an expensive JSON-RPC call; the tracks
+    of an album share the same art, so the lookup is done once and the
+    result is reused as long as the local file exists and has the same
+    mtime. URLs that have no local file yet (Kodi has not cached the art)
+    are remembered as well and retried after retry_timeout seconds.
+
+    An entry may also carry the dominant color of the art, to be shown as
+    a placeholder while the art is being decoded."""
+
+    def __init__(self, json_call, size=128, retry_timeout=30):
+        self._json_call = json_call
+        self._size = size
+        self._retry_timeout = retry_timeout
+        # url -> (path, mtime, color); for negative entries, path is None
+        # and mtime is the time when to retry
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def _store(self, url, path):
+        if path is not None:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                path = None
+        if path is None:
+            mtime = time.time() + self._retry_timeout
+        with self._lock:
+            self._entries[url] = (path, mtime, None)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+        return path
+
+
+    def _lookup(self, url):
+        textures = self._json_call('Textures.GetTextures',
+                                   properties=['cachedurl'],
+                                   filter={'field': 'url', 'operator': 'is',
+                                           'value': url})['textures']
+        if textures:
+            return xbmc.translatePath('special://thumbnails/' + textures[0]['cachedurl'])
+        if url.startswith('/'):
+            # if the art is not cached, we can use it directly if it's on
+            # a local filesystem
+            return url
+        # for all other cases, we go with no art
+        return None
+
+
+    def get(self, url):
+        """Returns the local path of the art with the given URL or None if
+        there's no usable local file."""
+        if not url:
+            return None
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+        if entry is not None:
+            path, mtime, _ = entry
+            if path is None:
+                if time.time() < mtime:
+                    return None
+            else:
+                try:
+                    if os.stat(path).st_mtime == mtime:
+                        return path
+                except OSError:
+                    pass
+        return self._store(url, self._lookup(url))
+
+
+    def color(self, url):
+        """Returns the dominant color of the art stored by set_color or None
+        if not known."""
+        with self._lock:
+            entry = self._entries.get(url)
+        return entry[2] if entry else None
+
+
+    def set_color(self, url, color):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries[url] = entry[:2] + (color,)
+
+
+    def prefill(self, urls):
+        """Resolves the given URLs by a single texture database query. Meant
+        to be run in the background."""
+        urls = [u for u in urls if u]
+        if not urls:
+            return
+        rules = [{'field': 'url', 'operator': 'is', 'value': u} for u in urls]
+        textures = self._json_call('Textures.GetTextures',
+                                   properties=['url', 'cachedurl'],
+                                   filter={'or': rules})['textures']
+        for t in textures:
+            self._store(t['url'], xbmc.translatePath('special://thumbnails/' + t['cachedurl']))
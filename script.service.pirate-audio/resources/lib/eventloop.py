@@ -0,0 +1,159 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+# Copyright (c) 2020 Jiri Benc <jbenc@upir.cz>
+
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class EventLoop:
+    """Single threaded event dispatcher. Events posted from any thread and
+    expired timers are processed one by one in the loop thread, so the
+    handlers never race with each other. Blocking work is run in a pool of
+    worker threads by run_in_executor and its result is passed back to the
+    loop thread.
+
+    An event may be posted with a key. A pending event with the same key is
+    superseded by the newer one, only the newer one is processed."""
+
+    def __init__(self, workers=2, error=None):
+        self._cond = threading.Condition()
+        # key -> (func, args)
+        self._events = collections.OrderedDict()
+        # heap of [deadline, timer id, interval, func, args]; a cancelled
+        # timer has func set to None and is dropped when it expires
+        self._timers = []
+        self._timer_ids = itertools.count(1)
+        self._active_timers = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._error = error
+        self._running = False
+        self._thread = None
+
+
+    def post(self, func, *args, key=None):
+        with self._cond:
+            if key is None:
+                key = object()
+            else:
+                self._events.pop(key, None)
+            self._events[key] = (func, args)
+            self._cond.notify()
+
+
+    def _add_timer(self, secs, interval, func, args):
+        with self._cond:
+            timer_id = next(self._timer_ids)
+            entry = [time.time() + secs, timer_id, interval, func, args]
+            heapq.heappush(self._timers, entry)
+            self._active_timers[timer_id] = entry
+            self._cond.notify()
+        return timer_id
+
+
+    def call_later(self, secs, func, *args):
+        return self._add_timer(secs, 0, func, args)
+
+
+    def call_every(self, secs, func, *args):
+        return self._add_timer(secs, secs, func, args)
+
+
+    def cancel(self, timer_id):
+        if timer_id is None:
+            return
+        with self._cond:
+            entry = self._active_timers.pop(timer_id, None)
+            if entry:
+                entry[3] = None
+
+
+    def run_in_executor(self, func, *args, callback=None):
+        """Runs func(*args) in a worker thread. When it finishes, its result
+        is passed to callback in the loop thread."""
+
+        def done(future):
+            exc = future.exception()
+            if exc is not None:
+                self.post(self._report, exc)
+            elif callback is not None:
+                self.post(callback, future.result())
+
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(done)
+        return future
+
+
+    def _report(self, exc):
+        if self._error:
+            self._error(exc)
+        else:
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+
+
+    def _wait(self):
+        """Waits for pending events or expired timers and returns the list
+        of (func, args, timer) to dispatch. Called with the lock held."""
+        now = time.time()
+        while self._running:
+            timeout = None
+            while self._timers and self._timers[0][3] is None:
+                heapq.heappop(self._timers)
+            now = time.time()
+            if self._timers:
+                timeout = self._timers[0][0] - now
+            if self._events or (timeout is not None and timeout <= 0):
+                break
+            self._cond.wait(timeout)
+        ready = [(func, args, None) for func, args in self._events.values()]
+        self._events.clear()
+        while self._timers and self._timers[0][0] <= now:
+            entry = heapq.heappop(self._timers)
+            if entry[3] is None:
+                continue
+            ready.append((entry[3], entry[4], entry))
+            if entry[2]:
+                entry[0] += entry[2]
+                if entry[0] <= now:
+                    # do not try to catch up if we're late
+                    entry[0] = now + entry[2]
+                heapq.heappush(self._timers, entry)
+        return ready
+
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ready = self._wait()
+                if not self._running:
+                    break
+            for func, args, timer in ready:
+                if timer is not None:
+                    with self._cond:
+                        if timer[3] is None:
+                            # cancelled by one of the previous handlers
+                            continue
+                        if not timer[2]:
+                            del self._active_timers[timer[1]]
+                try:
+                    func(*args)
+                except Exception as e:
+                    self._report(e)
+
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._executor.shutdown(wait=False)
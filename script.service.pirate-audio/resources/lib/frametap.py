@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+# Copyright (c) 2020 Jiri Benc <jbenc@upir.cz>
+
+import os
+import socket
+import struct
+import threading
+import zlib
+import piratedisplay
+
+# Every message consists of a header followed by a zlib compressed payload
+# with the pixels of the changed rectangle, row by row, 3 bytes (R, G, B)
+# per pixel. The first message sent to a client always covers the whole
+# frame. The format must stay identical to the one in
+# tools/frametap-viewer.py.
+#   magic, frame sequence number, x, y, width, height, payload length
+header = struct.Struct('>4sIHHHHI')
+MAGIC = b'PAFT'
+
+
+def encode(prev, frame, width, height, seq):
+    """Encodes the difference of frame to prev. Returns None if the frames
+    are identical."""
+    stride = width * 3
+    if prev is None or len(prev) != len(frame):
+        x0, y0, x1, y1 = 0, 0, width, height
+    else:
+        if prev == frame:
+            return None
+        y0 = piratedisplay.common_prefix(prev, frame) // stride
+        y1 = height - piratedisplay.common_suffix(prev, frame) // stride
+        x0, x1 = width, 0
+        for y in range(y0, y1):
+            a = prev[y * stride:(y + 1) * stride]
+            b = frame[y * stride:(y + 1) * stride]
+            if a == b:
+                continue
+            x0 = min(x0, piratedisplay.common_prefix(a, b) // 3)
+            x1 = max(x1, width - piratedisplay.common_suffix(a, b) // 3)
+    rows = b''.join(frame[y * stride + x0 * 3:y * stride + x1 * 3]
+                    for y in range(y0, y1))
+    payload = zlib.compress(rows, 1)
+    return header.pack(MAGIC, seq & 0xffffffff, x0, y0, x1 - x0, y1 - y0,
+                       len(payload)) + payload
+
+
+class FrameTap:
+    """Publishes the frames sent to the display to clients connected to
+    a local socket. The address is either a path of a Unix socket or
+    a (host, port) tuple for TCP.
+
+    Publishing never blocks on the clients. Every client is served by its
+    own thread that always picks up the latest frame; a slow client just
+    misses the frames that were published while it was busy. Without
+    clients, publishing only stores a reference to the frame."""
+
+    def __init__(self, address, width, height):
+        self.width = width
+        self.height = height
+        self._frame = None
+        self._seq = 0
+        self._clients = 0
+        self._cond = threading.Condition()
+        self._path = None
+
+        if isinstance(address, str):
+            self._path = address
+            try:
+                os.unlink(address)
+            except OSError:
+                pass
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(address)
+        self._sock.listen(2)
+        self._accept_thread = threading.Thread(target=self._accept)
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            # do not let a stuck client hang its thread forever
+            conn.settimeout(10)
+            with self._cond:
+                self._clients += 1
+            t = threading.Thread(target=self._serve, args=(conn,))
+            t.daemon = True
+            t.start()
+
+
+    def _serve(self, conn):
+        prev = None
+        seq = None
+        try:
+            while True:
+                with self._cond:
+                    while self._frame is None or self._seq == seq:
+                        self._cond.wait()
+                    seq = self._seq
+                    frame = self._frame
+                msg = encode(prev, frame, self.width, self.height, seq)
+                if msg:
+                    conn.sendall(msg)
+                prev = frame
+        except OSError:
+            pass
+        finally:
+            with self._cond:
+                self._clients -= 1
+            conn.close()
+
+
+    def publish(self, data):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        with self._cond:
+            self._frame = data
+            if self._clients:
+                self._seq += 1
+                self._cond.notify_all()
+
+
+    def close(self):
+        self._sock.close()
+        if self._path:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
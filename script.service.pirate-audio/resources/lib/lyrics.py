@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+# Copyright (c) 2020 Jiri Benc <jbenc@upir.cz>
+
+import bisect
+import re
+
+# [mm:ss], [mm:ss.xx] or [mm:ss:xx] time tags; more than one tag may
+# precede the text if the line is repeated in the song
+_time_tag = re.compile(r'\[(\d+):(\d+)(?:[.:](\d+))?\]')
+# enhanced LRC per-word time stamps, <mm:ss.xx>
+_word_tag = re.compile(r'<\d+:\d+(?:[.:]\d+)?>')
+_offset_tag = re.compile(r'\[offset:\s*([+-]?\d+)\]', re.IGNORECASE)
+
+
+class Lyrics:
+    """Synchronized lyrics. The LRC text is parsed once into a timeline
+    sorted by time; looking up the line for a given playback position is
+    a bisection, so seeking is O(log n) regardless of the lyrics length."""
+
+    def __init__(self, text):
+        self.times = []
+        self.lines = []
+        offset = 0
+        entries = []
+        for raw in text.splitlines():
+            m = _offset_tag.match(raw.strip())
+            if m:
+                # positive offset means the lyrics should be shown sooner
+                offset = int(m.group(1)) / 1000.0
+                continue
+            pos = 0
+            stamps = []
+            while True:
+                m = _time_tag.match(raw, pos)
+                if not m:
+                    break
+                frac = m.group(3) or '0'
+                stamps.append(int(m.group(1)) * 60 + int(m.group(2)) +
+                              int(frac) / 10.0 ** len(frac))
+                pos = m.end()
+            if not stamps:
+                # metadata tags ([ar:...], [ti:...]) and untimed text
+                continue
+            line = ' '.join(_word_tag.sub('', raw[pos:]).split())
+            for t in stamps:
+                entries.append((t, len(entries), line))
+        # the sequence number keeps lines with the same time stamp in the
+        # file order
+        entries.sort()
+        for t, _, line in entries:
+            self.times.append(max(t - offset, 0))
+            self.lines.append(line)
+
+
+    def __len__(self):
+        return len(self.lines)
+
+
+    def index(self, pos):
+        """Returns the index of the line being sung at the playback position
+        pos (in seconds), or -1 before the first line."""
+        return bisect.bisect_right(self.times, pos) - 1
+
+
+    def next_change(self, index):
+        """Returns the time of the line boundary following the line with
+        the given index, or None if it is the last line."""
+        if index + 1 >= len(self.times):
+            return None
+        return self.times[index + 1]
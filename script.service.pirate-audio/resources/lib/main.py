@@ -1,19 +1,18 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 # Copyright (c) 2020 Jiri Benc <jbenc@upir.cz>
 
-import xbmc
+import xbmc, xbmcvfs
 import piratedisplay
+import artcache, eventloop, lyrics
 import PIL, PIL.Image, PIL.ImageDraw, PIL.ImageFont, PIL.ImageEnhance
-import json, os, time
+import json, os, threading, time, traceback
 
 
-def multiline_text(draw, xy, text, font, fill, spacing=0, max_rows=None):
-    row = 0
-    x, y = xy
-    height = sum(font.getmetrics()) + spacing
+def wrap_text(draw, text, font, max_rows=None):
+    rows = []
     words = text.split()
     words.reverse()
-    while words and (max_rows is None or row < max_rows):
+    while words and (max_rows is None or len(rows) < max_rows):
         line = []
         while words:
             line.append(words.pop())
@@ -21,9 +20,16 @@ def multiline_text(draw, xy, text, font, fill, spacing=0, max_rows=None):
             if width > piratedisplay.width and len(line) > 1:
                 words.append(line.pop())
                 break
-        draw.text((x, y), ' '.join(line), font=font, fill=fill)
+        rows.append(' '.join(line))
+    return rows
+
+
+def multiline_text(draw, xy, text, font, fill, spacing=0, max_rows=None):
+    x, y = xy
+    height = sum(font.getmetrics()) + spacing
+    for line in wrap_text(draw, text, font, max_rows):
+        draw.text((x, y), line, font=font, fill=fill)
         y += height
-        row += 1
 
 
 def center_text(draw, y, text, font, fill=(255, 255, 255)):
@@ -59,12 +65,28 @@ class RpcError(Exception):
 
 
 class PirateAddon(xbmc.Monitor):
+    """All the state is owned by the event loop thread. Kodi notifications,
+    button presses and timers are queued as events to the loop; blocking
+    calls (JSON-RPC, screenshots, image decoding) are done by jobs in worker
+    threads that pass their results back to the loop."""
+
     def __init__(self):
         super(PirateAddon, self).__init__()
 
         self.pause_timeout = 60
         self.help_timeout = 8
         self.help_reshow_interval = 60
+        # display power states (see piratedisplay.power_states) stepped
+        # through while playing and while paused, as (seconds, state)
+        # pairs; any button press restarts the schedule
+        self.play_power_schedule = ()
+        self.pause_power_schedule = ((10, 'dim'), (30, 'idle'))
+        # debugging: publish the displayed frames on a Unix socket path or
+        # a (host, port) tuple, see tools/frametap-viewer.py
+        self.frame_tap = None
+        # debugging: log the number of bytes sent to the display over SPI
+        # every that many seconds (at the debug level)
+        self.spi_stats_interval = 60
 
         self.font_title = PIL.ImageFont.truetype('/usr/share/fonts/truetype/liberation/LiberationSansNarrow-Bold.ttf',
                                                  30)
@@ -74,13 +96,22 @@ class PirateAddon(xbmc.Monitor):
                                                32)
         self.font_symxl = PIL.ImageFont.truetype('/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf',
                                                  100)
+        self.font_lyrics = PIL.ImageFont.truetype('/usr/share/fonts/truetype/liberation/LiberationSansNarrow-Regular.ttf',
+                                                  24)
+        self.font_lyrics_cur = PIL.ImageFont.truetype('/usr/share/fonts/truetype/liberation/LiberationSansNarrow-Bold.ttf',
+                                                      24)
         self.font_title_height = sum(self.font_title.getmetrics())
         self.font_sub_height = sum(self.font_sub.getmetrics())
+        self.font_lyrics_height = sum(self.font_lyrics.getmetrics())
+        # the progress bar and time at the bottom of the player view
+        self.progress_rows = (piratedisplay.height - self.font_sub_height, piratedisplay.height - 1)
 
         self.blank = PIL.Image.new('RGB', (piratedisplay.width, piratedisplay.height),
                                    color=(0, 0, 0))
         self.img_bg = None
         self.img_bg_cache = None
+        self.play_started = None
+        self.notification_received = None
         self.img_info = None
         self.img_popup = None
         self.img_info_timer = None
@@ -91,6 +122,10 @@ class PirateAddon(xbmc.Monitor):
               'init': self.notification_play,
               'notification': self.notification_play,
               'button': self.button_event_play },
+            { 'help': (u'\u23ef', u'\U0001f50a', u'\u23ed', u'\U0001f509'),
+              'init': self.notification_lyrics,
+              'notification': self.notification_lyrics,
+              'button': self.button_event_play },
             { 'help': (u'[\u21f5', u'\u21f5]', u'\u22ef', u'\U0001f501'),
               'init': self.screenshot,
               'button': self.button_event_screen_move },
@@ -116,10 +151,80 @@ class PirateAddon(xbmc.Monitor):
         self.playing = False
         self.paused = False
         self.pause_timer = None
+        self.power_schedule = None
+        self.power_timers = []
+        self.lyrics = None
+        self.lyrics_path = None
+        self.lyrics_index = None
+        self.lyrics_anchor = (0, 0)
+        self.lyrics_tiles = {}
         # force help to be displayed the first time
         self.last_hidden = time.time() - self.help_reshow_interval
 
-        self.disp = piratedisplay.PirateDisplay(button_repeat_hz=5, event=self.button_event)
+        # incremented by every job that replaces the screen content; the
+        # results of superseded jobs are discarded
+        self.job_id = 0
+        self.view_id = 0
+        self.playing_info_pending = False
+        self.lyrics_sync_id = 0
+        self.volume_lock = threading.Lock()
+        self.screenshot_lock = threading.Lock()
+
+        self.loop = eventloop.EventLoop(error=self.log_error)
+        self.art_cache = artcache.ArtCache(self.json_call)
+        self.loop.run_in_executor(self.prefill_art_cache)
+
+        self.disp = piratedisplay.PirateDisplay(button_repeat_hz=5, event=self.on_button,
+                                                frame_tap=self.frame_tap)
+        self.spi_stats_bytes = 0
+        self.loop.call_every(self.spi_stats_interval, self.log_spi_stats)
+        self.loop.start()
+
+
+    def log_error(self, exc):
+        xbmc.log('pirate-audio: ' + ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__)),
+                 xbmc.LOGERROR)
+
+
+    def log_spi_stats(self):
+        tx_bytes = self.disp.tx_bytes
+        if tx_bytes != self.spi_stats_bytes:
+            xbmc.log('pirate-audio: sent {} bytes to the display in the last {} s'.format(
+                         tx_bytes - self.spi_stats_bytes, self.spi_stats_interval),
+                     xbmc.LOGDEBUG)
+            self.spi_stats_bytes = tx_bytes
+
+
+    def start_job(self, func, *args, callback):
+        """Runs func in a worker thread and passes its result to callback in
+        the loop thread, unless another job was started or the jobs were
+        cancelled meanwhile."""
+        self.job_id += 1
+        job_id = self.job_id
+
+        def done(result):
+            if job_id == self.job_id:
+                callback(result)
+
+        self.loop.run_in_executor(func, *args, callback=done)
+
+
+    def start_query(self, func, *args, callback):
+        """Like start_job but does not supersede other jobs. The result is
+        discarded only when the jobs are cancelled (view switched or screen
+        hidden)."""
+        view_id = self.view_id
+
+        def done(result):
+            if view_id == self.view_id:
+                callback(result)
+
+        self.loop.run_in_executor(func, *args, callback=done)
+
+
+    def cancel_jobs(self):
+        self.job_id += 1
+        self.view_id += 1
 
 
     def json_call(self, method, **kwargs):
@@ -133,11 +238,12 @@ class PirateAddon(xbmc.Monitor):
         return res['result']
 
 
-    def new_background(self, path=None, brightness=None, quadrant=None):
-        if path and not quadrant and self.img_bg_cache and self.img_bg_cache[:2] == (path, brightness):
+    def load_background(self, path=None, brightness=None, quadrant=None, reuse=True):
+        # called from worker threads, must not change any state
+        cache = self.img_bg_cache
+        if reuse and path and not quadrant and cache and cache[:2] == (path, brightness):
             # the image is unchanged, use the cached version
-            self.img_bg = self.img_bg_cache[2]
-            return
+            return cache[2]
 
         res = PIL.Image.new('RGB', (piratedisplay.width, piratedisplay.height),
                             color=(0, 0, 0))
@@ -164,8 +270,16 @@ class PirateAddon(xbmc.Monitor):
             if brightness:
                 enh = PIL.ImageEnhance.Brightness(res)
                 res = enh.enhance(brightness)
-        self.img_bg = res
-        self.img_bg_cache = (path, brightness, res)
+        return res
+
+
+    def set_background(self, img, path=None, brightness=None, url=None):
+        self.img_bg = img
+        self.img_bg_cache = (path, brightness, img, url)
+
+
+    def new_background(self, path=None, brightness=None, quadrant=None):
+        self.set_background(self.load_background(path, brightness, quadrant), path, brightness)
 
 
     def new_overlay_info(self, preserve_timer=False):
@@ -178,19 +292,17 @@ class PirateAddon(xbmc.Monitor):
 
 
     def new_overlay_popup(self, timeout):
-        if self.img_popup_timer is not None:
-            self.disp.del_user_timer(self.img_popup_timer)
+        self.loop.cancel(self.img_popup_timer)
         img = PIL.Image.new('RGBA', (piratedisplay.width, piratedisplay.height),
                             color=(0, 0, 0, 0))
         self.img_popup = img
-        self.img_popup_timer = self.disp.add_user_timer(timeout, self.delete_popup)
+        self.img_popup_timer = self.loop.call_later(timeout, self.delete_popup)
         return PIL.ImageDraw.Draw(img)
 
 
     def remove_overlay_info(self):
-        if self.img_info_timer is not None:
-            self.disp.del_user_timer(self.img_info_timer)
-            self.img_info_timer = None
+        self.loop.cancel(self.img_info_timer)
+        self.img_info_timer = None
         self.img_info = None
 
 
@@ -203,15 +315,41 @@ class PirateAddon(xbmc.Monitor):
         boxed_text(draw, piratedisplay.width - 1, piratedisplay.height - 52, 'right', bottomright, self.font_sym, fill)
 
 
-    def delete_popup(self, timer_id=None):
+    def delete_popup(self):
+        self.img_popup_timer = None
         self.img_popup = None
         self.redraw()
 
 
-    def hide(self, timer_id=None):
+    def hide(self):
+        self.cancel_jobs()
         self.remove_overlay_info()
         self.img_bg = None
         self.redraw()
+        self.stop_power_schedule()
+
+
+    def set_power_state(self, state, rows=None):
+        if self.disp.sleeping:
+            return
+        # restrict the display to rows only in the idle state, the rest of
+        # the screen should still be visible when just dimmed
+        self.disp.set_power_state(state, rows if state == 'idle' else None)
+
+
+    def start_power_schedule(self, schedule, rows=None):
+        self.stop_power_schedule()
+        self.power_schedule = (schedule, rows)
+        self.power_timers = [self.loop.call_later(secs, self.set_power_state, state, rows)
+                             for secs, state in schedule]
+
+
+    def stop_power_schedule(self):
+        for timer_id in self.power_timers:
+            self.loop.cancel(timer_id)
+        self.power_timers = []
+        self.power_schedule = None
+        self.set_power_state('normal')
 
 
     def redraw(self):
@@ -231,17 +369,8 @@ class PirateAddon(xbmc.Monitor):
         self.last_hidden = None
 
 
-    def set_playing_info(self, timer_id=None, initial=False):
-
-        def to_secs(s):
-            res = 0
-            try:
-                for t in s.split(':'):
-                    res = res * 60 + int(t)
-            except ValueError:
-                return 0
-            return res
-
+    def read_playing_info(self, initial=False):
+        # runs in a worker thread, info labels may block on Kodi's GUI lock
         duration = xbmc.getInfoLabel('Player.Duration')
         if initial:
             # when changing songs, Kodi returns old data for duration,
@@ -260,6 +389,42 @@ class PirateAddon(xbmc.Monitor):
         except AttributeError:
             # Python 3
             pass
+        return { 'duration': duration, 'elapsed': elapsed, 'title': title,
+                 'artist': artist, 'album': album,
+                 'art': xbmc.getInfoLabel('Player.Art(thumb)') }
+
+
+    def update_playing_info(self):
+        # the previous query is still waiting for Kodi, don't pile them up
+        if self.playing_info_pending:
+            return
+        self.playing_info_pending = True
+        timer_id = self.img_info_timer
+
+        def done(info):
+            self.playing_info_pending = False
+            # discard if the screen was changed meanwhile
+            if timer_id == self.img_info_timer:
+                self.set_playing_info(info)
+
+        self.loop.run_in_executor(self.read_playing_info, callback=done)
+
+
+    def set_playing_info(self, info, initial=False):
+
+        def to_secs(s):
+            res = 0
+            try:
+                for t in s.split(':'):
+                    res = res * 60 + int(t)
+            except ValueError:
+                return 0
+            return res
+
+        duration = info['duration']
+        elapsed = info['elapsed']
+        title = info['title']
+        artist = info['artist']
 
         # there's 'Player.Progress' infolabel but it always returns an empty
         # string, calculate the progress manually. While doing so, normalize
@@ -286,13 +451,46 @@ class PirateAddon(xbmc.Monitor):
             self.redraw()
 
 
+    def prefill_art_cache(self, count=50):
+        # resolve art of the recently played songs in advance, chances are
+        # they'll be played again
+        try:
+            songs = self.json_call('AudioLibrary.GetRecentlyPlayedSongs',
+                                   properties=['thumbnail'],
+                                   limits={'start': 0, 'end': count}).get('songs', [])
+            urls = set(artcache.unwrap_image_url(s['thumbnail']) for s in songs)
+            self.art_cache.prefill(urls)
+        except RpcError as e:
+            xbmc.log('pirate-audio: art cache prefill failed: {}'.format(e), xbmc.LOGWARNING)
+
+
+    def load_playing_art(self, url):
+        # runs in a worker thread; returns the art url, its local path, the
+        # background image and its dominant color
+        path = self.art_cache.get(url)
+        # The color is set only after the image was decoded and it's dropped
+        # when the art cache resolves the url anew, i.e. when the file
+        # changed. Without it, an image of the same path decoded earlier
+        # must not be reused.
+        img = self.load_background(path, 0.2, reuse=self.art_cache.color(url) is not None)
+        # the most common color of the image reduced to 4 colors
+        colors = img.resize((16, 16)).quantize(colors=4).convert('RGB').getcolors()
+        return url, path, img, max(colors)[1]
+
+
+    def set_art_background(self, art):
+        url, path, img, color = art
+        self.set_background(img, path, 0.2, url)
+        self.art_cache.set_color(url, color)
+
+
     def notification_play(self, method=None):
         # method will be None in the case of a fake event after mode switch
 
         if method == 'Player.OnResume':
-            if self.pause_timer is not None:
-                self.disp.del_user_timer(self.pause_timer)
-                self.pause_timer = None
+            self.loop.cancel(self.pause_timer)
+            self.pause_timer = None
+            self.start_power_schedule(self.play_power_schedule)
             if self.img_info_timer is not None:
                 # pause was short enough and the screen was not hidden yet,
                 # no need to do anything here
@@ -300,64 +498,268 @@ class PirateAddon(xbmc.Monitor):
         elif method == 'Player.OnPause' or (method is None and self.paused):
             # set timer to hide the screen after a minute, we don't want to
             # be burning it indefinitely
-            self.pause_timer = self.disp.add_user_timer(self.pause_timeout, self.hide)
+            self.pause_timer = self.loop.call_later(self.pause_timeout, self.hide)
+            self.start_power_schedule(self.pause_power_schedule, self.progress_rows)
             return
         elif method is not None and method != 'Player.OnPlay' and method != 'Player.OnStop':
             return
 
-        if self.playing:
-            cache = None
-            icon = xbmc.getInfoLabel('Player.Art(thumb)')
-            if icon:
-                cache = self.json_call('Textures.GetTextures',
-                                       properties=['cachedurl'],
-                                       filter={'field': 'url', 'operator': 'is',
-                                               'value': icon})['textures']
-                if cache:
-                    cache = xbmc.translatePath('special://thumbnails/' + cache[0]['cachedurl'])
-                elif icon.startswith('/'):
-                    # if the icon is not cached, we can use it directly if
-                    # it's on a local filesystem
-                    cache = icon
-                else:
-                    # for all other cases, we go with no icon (assign None
-                    # instead of the [])
-                    cache = None
+        if not self.playing:
+            self.hide()
+            return
 
-            self.remove_overlay_info()
-            self.new_background(cache, 0.2)
-            self.set_playing_info(initial=True)
-            if self.last_hidden is not None and \
-               time.time() - self.last_hidden > self.help_reshow_interval:
-                self.set_help(u'\u23ef', u'\U0001f50a', u'\u23ed', u'\U0001f509')
-            self.redraw()
-            self.img_info_timer = self.disp.add_recurrent_user_timer(1, self.set_playing_info)
+        # method is None after mode switch, there's no notification then
+        self.play_started = self.notification_received if method else time.time()
+        self.start_job(self.read_playing_info, True, callback=self.show_playing)
+
+
+    def show_playing(self, info):
+        # Show the text immediately. The art is decoded in the background
+        # and swapped in when ready; until then, a placeholder in the
+        # dominant color of the art is shown if the art was seen before.
+        url = info['art']
+        cache = self.img_bg_cache
+        color = self.art_cache.color(url)
+        if cache is not None and cache[0] and cache[3] == url and cache[1] == 0.2:
+            # the same art as of the previous track; it's still validated
+            # below, the art might have been re-cached meanwhile
+            self.set_background(cache[2], cache[0], 0.2, url)
+        elif color:
+            self.img_bg = PIL.Image.new('RGB', (piratedisplay.width, piratedisplay.height),
+                                        color=color)
+        else:
+            self.img_bg = self.blank
+        self.remove_overlay_info()
+        self.set_playing_info(info, initial=True)
+        if self.last_hidden is not None and \
+           time.time() - self.last_hidden > self.help_reshow_interval:
+            self.set_help(u'\u23ef', u'\U0001f50a', u'\u23ed', u'\U0001f509')
+        self.redraw()
+        xbmc.log('pirate-audio: time to first paint {:.0f} ms'.format((time.time() - self.play_started) * 1000),
+                 xbmc.LOGINFO)
+        self.img_info_timer = self.loop.call_every(1, self.update_playing_info)
+        # for a known album, this neither calls Kodi nor decodes the image
+        # again; a failed resolution is retried by the art cache
+        self.start_job(self.load_playing_art, url, callback=self.show_playing_art)
+        if self.paused:
+            self.start_power_schedule(self.pause_power_schedule, self.progress_rows)
         else:
+            self.start_power_schedule(self.play_power_schedule)
+
+
+    def show_playing_art(self, art):
+        self.set_art_background(art)
+        self.redraw()
+        xbmc.log('pirate-audio: time to complete {:.0f} ms'.format((time.time() - self.play_started) * 1000),
+                 xbmc.LOGINFO)
+
+
+    def load_lyrics(self):
+        # runs in a worker thread; returns the path of the playing file, its
+        # lyrics and the art
+        try:
+            path = xbmc.Player().getPlayingFile()
+        except RuntimeError:
+            path = ''
+        art = self.load_playing_art(xbmc.getInfoLabel('Player.Art(thumb)'))
+        if path == self.lyrics_path:
+            return path, self.lyrics, art
+        text = None
+        # a sidecar .lrc file takes precedence over lyrics embedded in the
+        # audio file, it's usually the synchronized one
+        lrc = os.path.splitext(path)[0] + '.lrc'
+        if path and xbmcvfs.exists(lrc):
+            f = xbmcvfs.File(lrc)
+            text = bytes(f.readBytes()).decode('utf-8-sig', 'ignore')
+            f.close()
+        if not text:
+            for player in self.json_call('Player.GetActivePlayers'):
+                if player['type'] == 'audio':
+                    text = self.json_call('Player.GetItem', playerid=player['playerid'],
+                                          properties=['lyrics'])['item'].get('lyrics')
+                    break
+        res = None
+        if text:
+            res = lyrics.Lyrics(text)
+            if not len(res):
+                # not synchronized
+                res = None
+        return path, res, art
+
+
+    def show_lyrics(self, result):
+        path, res, art = result
+        if path != self.lyrics_path:
+            self.lyrics_path = path
+            self.lyrics = res
+            self.lyrics_tiles = {}
+        self.set_art_background(art)
+        self.sync_lyrics()
+
+
+    def lyrics_tile(self, index, current):
+        key = (index, current)
+        if key not in self.lyrics_tiles:
+            font = self.font_lyrics_cur if current else self.font_lyrics
+            fill = (255, 255, 255) if current else (0x90, 0x90, 0x90)
+            draw = PIL.ImageDraw.Draw(self.blank)
+            rows = wrap_text(draw, self.lyrics.lines[index], font, max_rows=3) or ['']
+            img = PIL.Image.new('RGBA', (piratedisplay.width, len(rows) * self.font_lyrics_height),
+                                color=(0, 0, 0, 0))
+            draw = PIL.ImageDraw.Draw(img)
+            for i, line in enumerate(rows):
+                center_text(draw, i * self.font_lyrics_height, line, font, fill)
+            self.lyrics_tiles[key] = img
+        return self.lyrics_tiles[key]
+
+
+    def draw_lyrics(self, index):
+        draw = self.new_overlay_info(preserve_timer=True)
+        if not self.lyrics:
+            center_text(draw, None, 'No lyrics', font=self.font_sub, fill=(0xb0, 0xb0, 0xb0))
+            return
+        # The current line is placed a bit above the center of the screen,
+        # the surrounding lines fill the rest. The rendered lines are cached,
+        # advancing to the next line only renders the lines that changed
+        # their look or scrolled in.
+        used = {}
+        top = bottom = piratedisplay.height * 2 // 5
+        if index >= 0:
+            tile = used[(index, True)] = self.lyrics_tile(index, True)
+            top -= tile.height // 2
+            bottom = top + tile.height
+            self.img_info.paste(tile, (0, top), mask=tile)
+        i = index - 1
+        while i >= 0 and top > 0:
+            tile = used[(i, False)] = self.lyrics_tile(i, False)
+            top -= tile.height
+            self.img_info.paste(tile, (0, top), mask=tile)
+            i -= 1
+        i = index + 1
+        while i < len(self.lyrics) and bottom < piratedisplay.height:
+            tile = used[(i, False)] = self.lyrics_tile(i, False)
+            self.img_info.paste(tile, (0, bottom), mask=tile)
+            bottom += tile.height
+            i += 1
+        self.lyrics_tiles = used
+
+
+    def lyrics_tick(self):
+        self.loop.cancel(self.img_info_timer)
+        self.img_info_timer = None
+        pos = self.lyrics_anchor[0]
+        if not self.paused:
+            pos += time.time() - self.lyrics_anchor[1]
+        index = self.lyrics.index(pos) if self.lyrics else -1
+        if index != self.lyrics_index:
+            self.lyrics_index = index
+            self.draw_lyrics(index)
+            self.redraw()
+        if self.paused or not self.lyrics:
+            return
+        # no polling: wake up exactly at the next line boundary and
+        # re-anchor from the real playback position then, so that a stale
+        # position at the track start or a buffering stall does not shift
+        # the rest of the lines; wait at least a bit in case the position
+        # does not advance
+        t = self.lyrics.next_change(index)
+        if t is not None:
+            self.img_info_timer = self.loop.call_later(max(t - pos, 0.05),
+                                                       self.sync_lyrics, False)
+
+
+    def read_playing_time(self):
+        # runs in a worker thread; returns the playback position and the
+        # time it was read at
+        try:
+            pos = xbmc.Player().getTime()
+        except RuntimeError:
+            pos = 0
+        return pos, time.time()
+
+
+    def sync_lyrics(self, force=True):
+        self.lyrics_sync_id += 1
+        sync_id = self.lyrics_sync_id
+
+        def done(anchor):
+            # only the latest query counts
+            if sync_id != self.lyrics_sync_id:
+                return
+            # re-index the lyrics from the current playback position; this
+            # is a bisection, seeking is cheap even in long lyrics
+            self.lyrics_anchor = anchor
+            if force:
+                self.lyrics_index = None
+            self.lyrics_tick()
+
+        self.start_query(self.read_playing_time, callback=done)
+
+
+    def notification_lyrics(self, method=None):
+        # method will be None in the case of a fake event after mode switch
+
+        if method not in (None, 'Player.OnPlay', 'Player.OnStop', 'Player.OnPause',
+                          'Player.OnResume', 'Player.OnSeek'):
+            return
+        if not self.playing:
             self.hide()
+            return
+        self.loop.cancel(self.pause_timer)
+        self.pause_timer = None
+        if self.paused:
+            # set timer to hide the screen after a minute, we don't want to
+            # be burning it indefinitely
+            self.pause_timer = self.loop.call_later(self.pause_timeout, self.hide)
+            self.start_power_schedule(self.pause_power_schedule)
+        else:
+            self.start_power_schedule(self.play_power_schedule)
+        if method in (None, 'Player.OnPlay') or not self.img_bg:
+            self.start_job(self.load_lyrics, callback=self.show_lyrics)
+        else:
+            self.sync_lyrics()
 
 
-    def screenshot(self, clear=True):
+    def screenshot(self, clear=True, key=None):
         if clear:
             self.new_background()
             self.scr_pos = [0, 0]
         draw = self.new_overlay_info()
         boxed_text(draw, None, None, 'center', u'\u23f3', self.font_symxl)
         self.redraw()
+        self.start_job(self.take_screenshot, list(self.scr_pos), key,
+                       callback=self.show_screenshot)
+
+
+    def take_screenshot(self, quadrant, key=None, timeout=5):
+        # runs in a worker thread
+        with self.screenshot_lock:
+            if key:
+                self.json_call('Input.' + key)
+                # Need to wait a bit for the skin to have a chance to update
+                # the screen before taking screenshot. Note it's still not
+                # enough for some screens and manual reload is needed.
+                time.sleep(0.2)
+            filename = '/tmp/screenshot.png'
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            xbmc.executebuiltin('TakeScreenshot({},sync)'.format(filename))
+            deadline = time.time() + timeout
+            while not os.path.exists(filename) and time.time() < deadline:
+                time.sleep(0.1)
+            return self.load_background(filename, quadrant=quadrant)
 
-        filename = '/tmp/screenshot.png'
-        try:
-            os.unlink(filename)
-        except OSError:
-            pass
-        xbmc.executebuiltin('TakeScreenshot({},sync)'.format(filename))
-        while not os.path.exists(filename):
-            time.sleep(0.1)
+
+    def show_screenshot(self, img):
         self.remove_overlay_info()
-        self.new_background(filename, quadrant=self.scr_pos)
+        self.set_background(img)
         self.redraw()
         # set timer to hide the screen after a minute, we don't want to
         # be burning it indefinitely
-        self.pause_timer = self.disp.reset_user_timer(self.pause_timer, self.pause_timeout, self.hide)
+        self.loop.cancel(self.pause_timer)
+        self.pause_timer = self.loop.call_later(self.pause_timeout, self.hide)
 
 
     def next_action(self, first=0, last=None):
@@ -367,9 +769,13 @@ class PirateAddon(xbmc.Monitor):
         if self.cur_action > last:
             self.cur_action = first
         action = self.actions[self.cur_action]
-        if self.pause_timer is not None:
-            self.disp.del_user_timer(self.pause_timer)
-            self.pause_timer = None
+        self.cancel_jobs()
+        # the info of the previous view must not be updated in the new one
+        # while it's loading, nor stay there if the loading fails
+        self.remove_overlay_info()
+        self.loop.cancel(self.pause_timer)
+        self.pause_timer = None
+        self.stop_power_schedule()
         self.set_help(*action['help'])
         if 'init' in action:
             action['init']()
@@ -377,6 +783,16 @@ class PirateAddon(xbmc.Monitor):
 
     def onNotification(self, sender, method, data):
         super(PirateAddon, self).onNotification(sender, method, data)
+        # a newer player notification of the same kind supersedes a pending
+        # one, e.g. when skipping or seeking quickly
+        key = method if method.startswith('Player.') else None
+        self.loop.post(self.notification, method, time.time(), key=key)
+
+
+    def notification(self, method, received):
+        # when Kodi delivered the notification, to measure the latency
+        # including the time spent in the queue
+        self.notification_received = received
         if method == 'Player.OnPlay':
             self.playing = True
             self.paused = False
@@ -392,12 +808,20 @@ class PirateAddon(xbmc.Monitor):
             action['notification'](method)
 
 
+    def on_button(self, button, state):
+        # called from the button debouncer thread
+        self.loop.post(self.button_event, button, state)
+
+
     def button_event(self, button, state):
+        if self.power_schedule:
+            # show the screen in full again
+            self.start_power_schedule(*self.power_schedule)
         # long pressing (> 1 sec) B button always switches actions
         if button == 'B':
             if state == 2:
                 if self.action_switcher == 3:
-                    self.next_action(last=1)
+                    self.next_action(last=2)
                 self.action_switcher += 1
                 return
             if state == 0:
@@ -413,21 +837,8 @@ class PirateAddon(xbmc.Monitor):
         if button in ('X', 'Y'):
             if state == 0:
                 return
-            volume = self.json_call('Application.GetProperties', properties=['volume'])['volume']
-            if button == 'X':
-                volume = min(100, volume + 5)
-            else:
-                volume = max(0, volume - 5)
-            xbmc.executebuiltin('SetVolume({})'.format(volume))
-            draw = self.new_overlay_popup(timeout=5)
-            draw.rectangle((piratedisplay.width - 10, 0,
-                            piratedisplay.width - 1, piratedisplay.height - 1),
-                           outline=(255, 255, 255), width=1)
-            y = (piratedisplay.height - 2) * (100 - volume) // 100
-            draw.rectangle((piratedisplay.width - 9, y + 1,
-                            piratedisplay.width - 2, piratedisplay.height - 2),
-                           fill=(0, 255, 0))
-            self.redraw()
+            self.loop.run_in_executor(self.change_volume, 5 if button == 'X' else -5,
+                                      callback=self.show_volume)
             return
         if state != 1:
             return
@@ -437,11 +848,32 @@ class PirateAddon(xbmc.Monitor):
             xbmc.executebuiltin('PlayerControl(Next)')
 
 
+    def change_volume(self, delta):
+        # runs in a worker thread
+        with self.volume_lock:
+            volume = self.json_call('Application.GetProperties', properties=['volume'])['volume']
+            volume = min(100, max(0, volume + delta))
+            xbmc.executebuiltin('SetVolume({})'.format(volume))
+        return volume
+
+
+    def show_volume(self, volume):
+        draw = self.new_overlay_popup(timeout=5)
+        draw.rectangle((piratedisplay.width - 10, 0,
+                        piratedisplay.width - 1, piratedisplay.height - 1),
+                       outline=(255, 255, 255), width=1)
+        y = (piratedisplay.height - 2) * (100 - volume) // 100
+        draw.rectangle((piratedisplay.width - 9, y + 1,
+                        piratedisplay.width - 2, piratedisplay.height - 2),
+                       fill=(0, 255, 0))
+        self.redraw()
+
+
     def button_event_screen_move(self, button, state):
         if state != 1:
             return
         if button == 'B':
-            self.next_action(first=2)
+            self.next_action(first=3)
         elif button == 'A' or button == 'X':
             if self.scr_pos[0] == (0 if button == 'A' else 1):
                 self.scr_pos[1] = 1 - self.scr_pos[1]
@@ -456,15 +888,11 @@ class PirateAddon(xbmc.Monitor):
         if state != 1:
             return
         if button == 'B':
-            self.next_action(first=2)
+            self.next_action(first=3)
         else:
-            self.json_call('Input.' + data[button])
-            # Need to wait a bit for the skin to have a chance to update the
-            # screen before taking screenshot. Note it's still not enough
-            # for some screens and manual reload is needed.
-            time.sleep(0.2)
-            self.screenshot(clear=False)
+            self.screenshot(clear=False, key=data[button])
 
 
 addon = PirateAddon()
 addon.waitForAbort()
+addon.loop.stop()
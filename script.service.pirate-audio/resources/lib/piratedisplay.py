@@ -3,6 +3,7 @@
 
 import RPi.GPIO as GPIO
 import spidev
+import os
 import threading
 import time
 
@@ -18,19 +19,43 @@ BCM_BUTTON_X = 16
 BCM_BUTTON_Y = 20
 BCM_BUTTON_Y2 = 24      # newer revisions (after 23 January 2020)
 
+# The backlight is dimmed by the hardware PWM1 channel that GPIO13 can be
+# routed to, if it is enabled by the pwm overlay in /boot/config.txt:
+#   dtoverlay=pwm,pin=13,func=4
+# Otherwise, RPi.GPIO software PWM is used. That is a thread waking up
+# twice per period for as long as the backlight is dimmed, costing CPU
+# (and thus power) and jittering, which may flicker at low levels.
+BACKLIGHT_PWM_SYSFS = '/sys/class/pwm/pwmchip0'
+BACKLIGHT_PWM_CHANNEL = 1
+BACKLIGHT_PWM_HZ = 400
+
 # ST7789 commands
 SWRESET = 0x01
 SLPIN = 0x10
 SLPOUT = 0x11
+PTLON = 0x12
+NORON = 0x13
 INVON = 0x21
 DISPOFF = 0x28
 DISPON = 0x29
 CASET = 0x2a
 RASET = 0x2b
 RAMWR = 0x2c
+PTLAR = 0x30
 MADCTL = 0x36
+IDMOFF = 0x38
+IDMON = 0x39
 COLMOD = 0x3a
 
+# Display power states: backlight level, idle mode (8 colors only). In
+# addition, a power state may restrict the display to a range of rows
+# (partial mode), see set_power_state.
+power_states = {
+    'normal': (1.0, False),
+    'dim': (0.3, False),
+    'idle': (0.15, True),
+}
+
 # Button map
 button_map = {
     BCM_BUTTON_A: 'A',
@@ -48,10 +73,70 @@ button_map_90 = {
 }
 
 
+class SysfsPwm:
+    """Hardware PWM channel controlled through the kernel sysfs interface.
+    Raises OSError if the channel is not available."""
+
+    def __init__(self, chip, channel, hz):
+        self._dir = os.path.join(chip, 'pwm{}'.format(channel))
+        if not os.path.isdir(self._dir):
+            with open(os.path.join(chip, 'export'), 'w') as f:
+                f.write(str(channel))
+            # udev may need a moment to set up the new channel
+            for i in range(10):
+                if os.access(os.path.join(self._dir, 'enable'), os.W_OK):
+                    break
+                time.sleep(0.05)
+        self.period = 1000000000 // hz
+        self._write('duty_cycle', 0)
+        self._write('period', self.period)
+        self._write('enable', 1)
+
+
+    def _write(self, name, value):
+        with open(os.path.join(self._dir, name), 'w') as f:
+            f.write(str(value))
+
+
+    def set(self, level):
+        self._write('duty_cycle', int(self.period * level))
+
+
+def common_prefix(a, b):
+    """Returns the length of the common prefix of two bytes objects of the
+    same length. Bisects on slice comparisons, which are done in C."""
+    lo, hi = 0, len(a)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def common_suffix(a, b):
+    lo, hi = 0, len(a)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
 class PirateDisplay:
-    def __init__(self, button_repeat_hz=3, event=None, rotate=0):
+    def __init__(self, button_repeat_hz=3, event=None, rotate=0, frame_tap=None):
         # we currently support only rotate=0 and rotate=90
         self.rotate = rotate
+        # optionally publish the displayed frames on a socket for debugging;
+        # frame_tap is a Unix socket path or a (host, port) tuple
+        self._tap = None
+        if frame_tap:
+            # debugging only, the module is not needed otherwise
+            import frametap
+            self._tap = frametap.FrameTap(frame_tap, width, height)
         self.button_map = button_map_90 if rotate == 90 else button_map
         self.spi = spidev.SpiDev()
         # open /dev/spidev0.1
@@ -64,7 +149,19 @@ class PirateDisplay:
         GPIO.setwarnings(False)
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(BCM_LCD_DCX, GPIO.OUT)
-        GPIO.setup(BCM_LCD_BACKLIGHT, GPIO.OUT)
+        try:
+            # hardware PWM needs the pin in the PWM function, do not
+            # configure it as GPIO output then
+            self._backlight_hw_pwm = SysfsPwm(BACKLIGHT_PWM_SYSFS, BACKLIGHT_PWM_CHANNEL,
+                                              BACKLIGHT_PWM_HZ)
+        except OSError:
+            self._backlight_hw_pwm = None
+            GPIO.setup(BCM_LCD_BACKLIGHT, GPIO.OUT)
+            self._backlight_pwm = GPIO.PWM(BCM_LCD_BACKLIGHT, BACKLIGHT_PWM_HZ)
+        # unknown; the first backlight() call always drives the pin
+        self._backlight_level = None
+        # number of bytes sent over SPI, for statistics
+        self.tx_bytes = 0
         # the buttons connect to ground when pressed; need to configure
         # with pull up resistors
         GPIO.setup(tuple(self.button_map.keys()), GPIO.IN, pull_up_down=GPIO.PUD_UP)
@@ -98,10 +195,20 @@ class PirateDisplay:
         # need 10 ns delay for C/DX setup time (TDCS) but that's of no
         # concern as Python on Pi is not that fast
         self.spi.writebytes((cmd,))
+        self.tx_bytes += 1
         if data:
             GPIO.output(BCM_LCD_DCX, 1)
             # another 10 ns delay here
             self.spi.writebytes2(data)
+            self.tx_bytes += len(data)
+
+
+    def _set_rows(self, start, end):
+        # parameters to RASET are: start row (high), start row (low),
+        # end row (high), end row (low)
+        if (start, end) != self._rows:
+            self._command(RASET, (start >> 8, start & 0xff, end >> 8, end & 0xff))
+            self._rows = (start, end)
 
 
     def _button_set(self, pin, pressed):
@@ -270,10 +377,13 @@ class PirateDisplay:
         # parameters to CASET are: start column (high), start column (low),
         # end column (high), end column (low)
         self._command(CASET, (0, 0, (width - 1) >> 8, (width - 1) & 0xff))
-        # parameters to RASET are: start row (high), start row (low),
-        # end row (high), end row (low)
-        self._command(RASET, (0, 0, (height - 1) >> 8, (height - 1) & 0xff))
+        self._rows = None
+        self._set_rows(0, height - 1)
 
+        # the frame memory content is undefined after reset
+        self._frame = None
+        self._idle = False
+        self._partial = None
         self.sleeping = True
 
 
@@ -298,13 +408,89 @@ class PirateDisplay:
         # restore inverse mode; for some reason, sometimes it's not
         # preserved on wakeup
         self._command(INVON)
-        self.backlight(True)
         self.sleeping = False
+        self.set_power_state('normal')
 
 
     def backlight(self, on=True):
-        GPIO.output(BCM_LCD_BACKLIGHT, on)
+        """on is either a bool or the backlight level between 0 and 1.
+        Levels other than fully on or off use PWM, see BACKLIGHT_PWM_SYSFS."""
+        level = float(on)
+        if level == self._backlight_level:
+            return
+        if self._backlight_hw_pwm:
+            self._backlight_hw_pwm.set(level)
+            self._backlight_level = level
+            return
+        pwm_running = self._backlight_level is not None and 0 < self._backlight_level < 1
+        if 0 < level < 1:
+            if pwm_running:
+                self._backlight_pwm.ChangeDutyCycle(level * 100)
+            else:
+                self._backlight_pwm.start(level * 100)
+        else:
+            if pwm_running:
+                self._backlight_pwm.stop()
+            GPIO.output(BCM_LCD_BACKLIGHT, bool(level))
+        self._backlight_level = level
+
+
+    def idle(self, on=True):
+        """In the idle mode, only 8 colors are displayed (the most
+        significant bit of each color component) and the panel draws
+        less power."""
+        if on == self._idle:
+            return
+        self._command(IDMON if on else IDMOFF)
+        self._idle = on
+
+
+    def partial(self, rows=None):
+        """Restricts the display to the rows from rows[0] to rows[1]
+        (inclusive); the rest of the panel is not driven. None returns to
+        the normal mode. The partial area consists of physical rows of the
+        panel, thus it is not supported with rotate=90. Returns True if the
+        partial mode is active."""
+        if self.rotate == 90:
+            rows = None
+        if rows == self._partial:
+            return rows is not None
+        if rows is None:
+            self._command(NORON)
+        else:
+            start, end = rows
+            self._command(PTLAR, (start >> 8, start & 0xff, end >> 8, end & 0xff))
+            self._command(PTLON)
+        self._partial = rows
+        return rows is not None
+
+
+    def set_power_state(self, state, rows=None):
+        """Sets the power state (a key of power_states). rows optionally
+        restricts the display to the given rows, see partial()."""
+        level, idle = power_states[state]
+        self.backlight(level)
+        self.idle(idle)
+        self.partial(rows)
 
 
     def show(self, data):
-        self._command(RAMWR, data)
+        """Sends the frame to the display. Only the rows that changed since
+        the previous frame are transmitted; the frame memory is kept in the
+        sleep mode, only reset() invalidates it."""
+        stride = width * 3
+        start, end = 0, height
+        prev = self._frame
+        if prev is not None and len(prev) == len(data):
+            if prev == data:
+                return
+            start = common_prefix(prev, data) // stride
+            end = height - common_suffix(prev, data) // stride
+        self._frame = bytes(data)
+        self._set_rows(start, end - 1)
+        if start == 0 and end == height:
+            self._command(RAMWR, data)
+        else:
+            self._command(RAMWR, self._frame[start * stride:end * stride])
+        if self._tap:
+            self._tap.publish(self._frame)
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# SPDX-License-Identifier: GPL-2.0-or-later
+# Copyright (c) 2020 Jiri Benc <jbenc@upir.cz>
+
+"""Viewer for the frame tap of the piratedisplay module. Connects to the
+tap socket, reassembles the frames from the changed rectangles and shows
+them in a window, or saves them as PNG files."""
+
+import PIL, PIL.Image
+import argparse, os, socket, struct, zlib
+
+# The wire format, must stay identical to the one in
+# script.service.pirate-audio/resources/lib/frametap.py. It's not imported
+# from there, that would need the Raspberry Pi specific modules.
+header = struct.Struct('>4sIHHHHI')
+MAGIC = b'PAFT'
+
+
+def connect(address):
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.create_connection((host, int(port)))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+
+def recv_exact(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise EOFError
+        buf += chunk
+    return bytes(buf)
+
+
+def frames(sock):
+    """Yields (sequence number, image) for each received update."""
+    img = None
+    while True:
+        magic, seq, x, y, w, h, size = header.unpack(recv_exact(sock, header.size))
+        if magic != MAGIC:
+            raise ValueError('bad frame tap stream')
+        rect = PIL.Image.frombytes('RGB', (w, h), zlib.decompress(recv_exact(sock, size)))
+        if img is None:
+            # the first update always covers the whole frame
+            img = rect
+        else:
+            img.paste(rect, (x, y))
+        yield seq, img
+
+
+def save(sock, directory):
+    for seq, img in frames(sock):
+        img.save(os.path.join(directory, 'frame-{:08d}.png'.format(seq)))
+
+
+def show(sock, zoom):
+    import tkinter
+    import PIL.ImageTk
+
+    root = tkinter.Tk()
+    root.title('Pirate Audio frame tap')
+    label = tkinter.Label(root)
+    label.pack()
+    stream = frames(sock)
+    last = [None]
+
+    def update():
+        seq, img = next(stream)
+        if last[0] is not None and seq != last[0] + 1:
+            root.title('Pirate Audio frame tap ({} dropped)'.format(seq - last[0] - 1))
+        last[0] = seq
+        if zoom != 1:
+            img = img.resize((img.width * zoom, img.height * zoom), PIL.Image.NEAREST)
+        label.photo = PIL.ImageTk.PhotoImage(img)
+        label.configure(image=label.photo)
+
+    root.createfilehandler(sock, tkinter.READABLE, lambda *args: update())
+    root.mainloop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('address', help='Unix socket path or host:port')
+    parser.add_argument('-o', '--output', metavar='DIR',
+                        help='save the frames as PNG files to DIR instead of showing them')
+    parser.add_argument('-z', '--zoom', type=int, default=2,
+                        help='zoom factor of the window (default: 2)')
+    args = parser.parse_args()
+
+    sock = connect(args.address)
+    try:
+        if args.output:
+            save(sock, args.output)
+        else:
+            show(sock, args.zoom)
+    except (EOFError, KeyboardInterrupt):
+        pass
+
+
+if __name__ == '__main__':
+    main()